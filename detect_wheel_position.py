@@ -1,6 +1,9 @@
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from PIL import Image
+import cv2
 import matplotlib.pyplot as plt
 import pandas as pd
 import utils
@@ -9,6 +12,50 @@ import re
 from tqdm import tqdm
 
 
+_frame_buffer = None
+
+
+def _blank_frame(resolution: tuple) -> np.ndarray:
+    global _frame_buffer
+
+    shape = (resolution[1], resolution[0], 3)
+
+    if _frame_buffer is None or _frame_buffer.shape != shape:
+        _frame_buffer = np.full(shape, 255, dtype=np.uint8)
+    else:
+        _frame_buffer.fill(255)
+
+    return _frame_buffer
+
+
+def render_events_and_line(
+        resolution: tuple,
+        events: np.ndarray,
+        line_parameters: tuple,
+) -> np.ndarray:
+    """
+    Rasterizes an image showing the line corresponding with the given parameters (red line) into the given set of events (blue dots).
+
+    The returned image is a module-level buffer reused across calls; copy it if it must survive the next call.
+
+    :param resolution: width and height of the image
+    :param events: The events to be displayed, as an (xs, ys) tuple or an [N, 2] array
+    :param line_parameters: Endpoints (x1, y1, x2, y2) of the detected line.
+
+    :return: the rendered image.
+    """
+    image = _blank_frame(resolution)
+
+    xs, ys = utils.split_event_coordinates(events)
+    image[ys, xs] = (255, 0, 0)
+
+    if line_parameters is not None:
+        x1, y1, x2, y2 = line_parameters
+        cv2.line(image, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), 1, cv2.LINE_AA)
+
+    return image
+
+
 def display_events_and_line(
         resolution: tuple,
         events: np.ndarray,
@@ -18,48 +65,62 @@ def display_events_and_line(
         image_path: str = None,
 ) -> None:
     """
-    Presents a Matplotlib figure showing the line corresponding with the given parameters (red line) into the given set of events (blue dots).
+    Renders the image of the given events and detected line, then saves or displays it.
 
-    :param resolution: width and height of the figure
-    :param events: The events to be displayed
-    :param line_parameters: Rho and theta parameters of the line.
+    :param resolution: width and height of the image
+    :param events: The events to be displayed, as an (xs, ys) tuple or an [N, 2] array
+    :param line_parameters: Endpoints (x1, y1, x2, y2) of the detected line.
     :param display_image: If the image should be displayed
     :param save_image: If the image should be saved
-    :param image_path: Where the image should be saved
+    :param image_path: Where the image should be saved. The directory must already exist.
 
     :return: None
     """
-    fig = plt.figure(figsize=(resolution[0] / 100, resolution[1] / 100))
-    plt.xlim(0, resolution[0])
-    plt.ylim(resolution[1], 0)
+    image = render_events_and_line(resolution, events, line_parameters)
 
-    x, y = zip(*events)
-    plt.scatter(x, y, color='blue', label='Events', s=5)
+    if save_image:
+        cv2.imwrite(image_path, image, utils.png_write_parameters)
 
-    if line_parameters is not None:
-        rho, theta = line_parameters
-        a = np.cos(theta)
-        b = np.sin(theta)
-        x0 = a * rho
-        y0 = b * rho
-        x1 = int(x0 + 1000 * (-b))
-        y1 = int(y0 + 1000 * a)
-        x2 = int(x0 - 1000 * (-b))
-        y2 = int(y0 - 1000 * a)
-        plt.plot([x1, x2], [y1, y2], color='red', label='Detected Line')
-
-    plt.legend()
+    if display_image:
+        cv2.imshow('events and detected line', image)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
 
-    if save_image:
-        path, _ = os.path.split(image_path)
-        utils.handle_path(path)
 
-        plt.savefig(image_path)
+def process_slice(
+        slice_index: int,
+        resolution: tuple,
+        events: np.ndarray,
+        rho: int,
+        theta: float,
+        threshold: int,
+        render_image: bool = True,
+) -> tuple[int, float | None, np.ndarray | None]:
+    """
+    Detects the line angle in a single slice and optionally renders the corresponding image.
+
+    The image is PNG-encoded inside the worker process: the rendered frame lives in a buffer
+    reused across calls, so only the encoded copy can safely cross the process boundary, and
+    the encoding cost is spread over the pool instead of the writer threads.
 
-    if display_image:
-        plt.show()
+    :param slice_index: the position of the slice within the recording
+    :param resolution: width and height of the event stream
+    :param events: the events of the slice, as an (xs, ys) tuple or an [N, 2] array
+    :param rho: Rho parameter of the HoughLines algorithm
+    :param theta: Theta parameter of the HoughLines algorithm
+    :param threshold: The minimum number of intersection to detect a line
+    :param render_image: If the image of the slice should be rendered
 
-    plt.close(fig)
+    :return: the slice index, the angle of the detected line (or None if no line is detected) and the PNG-encoded image (or None).
+    """
+    angle, line_params = utils.detect_line_angle(resolution, events, rho, theta, threshold)
+
+    encoded_image = None
+    if render_image:
+        image = render_events_and_line(resolution, events, line_params)
+        encoded_image = cv2.imencode('.png', image, utils.png_write_parameters)[1]
+
+    return slice_index, angle, encoded_image
 
 
 def plot_angle_evolution(csv_angles_file: str) -> None:
@@ -83,10 +144,26 @@ def plot_angle_evolution(csv_angles_file: str) -> None:
     plt.close(fig)
 
 
+_slice_number_pattern = re.compile(r'\d+')
+
+
+def _slice_number(file_name: str) -> int | float:
+    match = _slice_number_pattern.search(file_name)
+    return int(match.group()) if match else float('inf')
+
+
+def _load_frames(source_images_path: str, file_names: list):
+    for file_name in file_names:
+        with Image.open(os.path.join(source_images_path, file_name)) as frame:
+            yield frame.copy()
+
+
 def create_gif_from(source_images_path: str, animation_path: str) -> None:
     """
     Create an animated gif from a set of png files.
 
+    The frames are decoded one at a time while the gif is written, so memory usage stays bounded regardless of the number of frames.
+
     :param source_images_path: The path to a directory containing the png files.
     :param animation_path: The path to a directory where the animation should be saved.
 
@@ -95,29 +172,16 @@ def create_gif_from(source_images_path: str, animation_path: str) -> None:
     path, _ = os.path.split(source_images_path)
     utils.handle_path(path)
 
-    file_names = sorted(os.listdir(source_images_path),
-                        key=lambda x: int(re.findall(r'\d+', x)[0]) if re.findall(r'\d+', x) else float('inf'))
+    file_names = sorted((f for f in os.listdir(source_images_path) if f.endswith('.png')), key=_slice_number)
 
-    images = [Image.open(os.path.join(source_images_path, f)) for f in file_names if f.endswith('.png')]
-
-    if images:
-        images[0].save(animation_path, save_all=True, append_images=images[1:], loop=1)
-
-
-def str2bool(v: bool | str) -> bool:
-    """
-    Converts a string to bool.
-
-    :param v: A string equivalent to a bool value.
-
-    :return: The corresponding bool value.
-    """
-    if isinstance(v, bool):
-        return v
-    if v.lower() in ('true','t', '1'):
-        return True
-    elif v.lower() in ('false', 'f', '0'):
-        return False
+    if file_names:
+        with Image.open(os.path.join(source_images_path, file_names[0])) as first_frame:
+            first_frame.save(
+                animation_path,
+                save_all=True,
+                append_images=_load_frames(source_images_path, file_names[1:]),
+                loop=1
+            )
 
 
 def get_execution_arguments() -> argparse.Namespace:
@@ -155,20 +219,27 @@ def get_execution_arguments() -> argparse.Namespace:
     )
     parser.add_argument(
         '-d', '--detect-wheel-position',
-        type=str2bool,
+        action=argparse.BooleanOptionalAction,
         default=True,
         help='Generate a directory containing one png image per processed slice and a csv file containing '
              'the angle of the detected line in each slice'
     )
+    parser.add_argument(
+        '-s', '--save-images',
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help='Save one png image per processed slice. Implied by --generate-gif. Angle-only runs '
+             'skip the whole rendering and encoding cost.'
+    )
     parser.add_argument(
         '-a', '--plot-angle-evolution',
-        type=str2bool,
+        action=argparse.BooleanOptionalAction,
         default=False,
         help='Plot and save the angle evolution.'
     )
     parser.add_argument(
         '-g', '--generate-gif',
-        type=str2bool,
+        action=argparse.BooleanOptionalAction,
         default=False,
         help='Generate a GIF animation.'
     )
@@ -179,32 +250,52 @@ def get_execution_arguments() -> argparse.Namespace:
 if __name__ == '__main__':
     args = get_execution_arguments()
     _, file_name = os.path.split(args.aedat4)
+    stem = os.path.splitext(file_name)[0]
+    images_directory = f"images_{stem}"
+    angles_csv_path = f"./detected_angles_{stem}.csv"
     data = utils.load_data_from(args.aedat4)
     source_resolution = utils.event_stream_resolution(data)
     source_events = utils.get_events_from(data)
     slices = utils.slice_every_events(source_events, args.events_per_slice)
 
     if args.detect_wheel_position:
-        detected_angles = {}
-
-        for i, s in tqdm(enumerate(slices), total=len(slices), desc='Processing slices', ncols=80, leave=False, colour='red'):
-            angle, line_params = utils.detect_line_angle(source_resolution, s, args.rho, args.theta, args.threshold)
-            detected_angles[i] = angle
-            display_events_and_line(
-                source_resolution,
-                s,
-                line_params,
-                save_image=True,
-                image_path=f"images_{file_name.split('.')[0]}/image_slice_{i}.png"
+        detected_angles = np.full(len(slices), np.nan, dtype=np.float32)
+        save_images = args.save_images or args.generate_gif
+        image_pool = None
+
+        if save_images:
+            utils.handle_path(images_directory)
+            image_pool = utils.SaveImagePool()
+
+        with ProcessPoolExecutor() as executor:
+            results = executor.map(
+                process_slice,
+                range(len(slices)),
+                repeat(source_resolution),
+                slices,
+                repeat(args.rho),
+                repeat(args.theta),
+                repeat(args.threshold),
+                repeat(save_images),
+                chunksize=max(1, len(slices) // (4 * os.cpu_count()))
             )
 
-        utils.save_dict_to_csv(detected_angles, f"./detected_angles_{file_name.split('.')[0]}.csv")
+            for i, angle, encoded_image in tqdm(results, total=len(slices), desc='Processing slices', ncols=80, leave=False, colour='red'):
+                if angle is not None:
+                    detected_angles[i] = angle
+                if encoded_image is not None:
+                    image_pool.submit(encoded_image, f"{images_directory}/image_slice_{i}.png")
+
+        if image_pool is not None:
+            image_pool.join()
+
+        utils.save_array_to_csv(detected_angles, angles_csv_path)
 
     if args.plot_angle_evolution:
-        plot_angle_evolution(f"./detected_angles_{file_name.split('.')[0]}.csv")
+        plot_angle_evolution(angles_csv_path)
 
     if args.generate_gif:
         create_gif_from(
-            f"./images_{file_name.split('.')[0]}",
-            f"./images_{file_name.split('.')[0]}/reference_{file_name.split('.')[0]}.gif"
+            images_directory,
+            f"{images_directory}/reference_{stem}.gif"
         )
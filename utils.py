@@ -1,12 +1,23 @@
-import csv
 import os.path
-import cv2
+import queue
+import threading
 import dv_processing as dv
 import logging
 import sys
 import cv2 as cv
 import numpy as np
 
+try:
+    import utils_numba
+except ImportError:
+    utils_numba = None
+
+# Fast deflate plus run-length filtering, which suits the mostly flat-colour slice images.
+png_write_parameters = [
+    cv.IMWRITE_PNG_COMPRESSION, 1,
+    cv.IMWRITE_PNG_STRATEGY, cv.IMWRITE_PNG_STRATEGY_RLE,
+]
+
 logger = logging.getLogger()
 date_time_string_format = '%Y-%m-%y %H:%M:%S'
 logging.basicConfig(
@@ -17,6 +28,58 @@ logging.basicConfig(
 )
 
 
+class SaveImagePool:
+    """
+    A pool of background worker threads that writes already-encoded images to disk.
+
+    The disk writes happen on the worker threads, so the caller can keep
+    processing the next slice while the pending images are saved.
+    """
+
+    def __init__(self, workers: int = 4):
+        self._queue = queue.Queue()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            encoded_image, path = item
+            try:
+                with open(path, 'wb') as image_file:
+                    image_file.write(encoded_image)
+            except OSError as e:
+                logger.error(f"Failed to save the image '{path}'. Error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, encoded_image: np.ndarray, path: str) -> None:
+        """
+        Queues the given encoded image to be saved on a background thread.
+
+        :param encoded_image: the encoded image bytes, e.g. the buffer returned by cv.imencode
+        :param path: where the image should be saved
+
+        :return: None
+        """
+        self._queue.put((encoded_image, path))
+
+    def join(self) -> None:
+        """
+        Waits until every queued image has been written and stops the workers.
+
+        :return: None
+        """
+        self._queue.join()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
 def load_data_from(aedat4_file: str) -> dv.io.MonoCameraRecording:
     """
     Load data from an Aedat4 file.
@@ -27,7 +90,7 @@ def load_data_from(aedat4_file: str) -> dv.io.MonoCameraRecording:
     """
     reader = dv.io.MonoCameraRecording(aedat4_file)
     if not reader.isEventStreamAvailable():
-        logger.critical("Something went wrong. The camera data does not have an event stream available.\n")
+        raise RuntimeError(f"The camera data in '{aedat4_file}' does not have an event stream available.")
 
     return reader
 
@@ -44,20 +107,36 @@ def event_stream_resolution(camera_data: dv.io.MonoCameraRecording) -> tuple:
     return resolution
 
 
+def iter_event_batches(data: dv.io.MonoCameraRecording):
+    """
+    Yields the event batches of the supplied data reader one at a time.
+
+    Streaming the batches keeps peak memory at one batch instead of the whole recording, and lets downstream filters and slicers work on each batch while it is still hot in cache.
+
+    :param data: An aedat4 file reader.
+
+    :return: a generator of event stores, one per recorded batch.
+    """
+    while data.isRunning():
+        batch = data.getNextEventBatch()
+        if batch is not None:
+            yield batch
+
+
 def get_events_from(data: dv.io.MonoCameraRecording) -> dv.EventStore:
     """
     Extract the event stream from the supplied data reader.
 
+    Accumulates every batch into one store; prefer iter_event_batches when the caller can process the recording incrementally.
+
     :param data: An aedat4 file reader.
 
     :return: Events contained in the supplied data reader.
     """
     events = dv.EventStore()
 
-    while data.isRunning():
-        temp_event_store = data.getNextEventBatch()
-        if temp_event_store is not None:
-            events.add(temp_event_store)
+    for batch in iter_event_batches(data):
+        events.add(batch)
 
     return events
 
@@ -68,6 +147,22 @@ def _calculate_crop_origin(center: tuple[int, int], width: int = 100, height: in
     return int(origin_x), int(origin_y)
 
 
+def _region_filter(center: tuple[int, int], crop_width: int, crop_height: int) -> dv.EventRegionFilter:
+    crop_origin = _calculate_crop_origin(center, crop_width, crop_height)
+    return dv.EventRegionFilter((*crop_origin, crop_width, crop_height))
+
+
+def _crop_events(
+        events: dv.EventStore,
+        center: tuple[int, int],
+        crop_width: int,
+        crop_height: int
+) -> dv.EventStore:
+    region_filter = _region_filter(center, crop_width, crop_height)
+    region_filter.accept(events)
+    return region_filter.generateEvents()
+
+
 def crop_centered_area(
         aedat4_file: str,
         center: tuple[int, int] = (173, 130),
@@ -77,6 +172,8 @@ def crop_centered_area(
     """
     Crop the area of the event stream within the supplied aedat4 file to a rectangular central area.
 
+    The recording is fed batch by batch through the region filter, so filtering overlaps file I/O and peak memory stays at one batch plus the filtered result.
+
     :param aedat4_file: path to the aedat4 file as a string.
     :param center: a tuple with the x and y coordinates of the center of the cropped area.
     :param crop_width: horizontal length of the cropped area.
@@ -84,11 +181,12 @@ def crop_centered_area(
 
     :return: An event store containing the events within the central area.
     """
-    crop_origin = _calculate_crop_origin(center, crop_width, crop_height)
-    region_filter = dv.EventRegionFilter((*crop_origin, crop_width, crop_height))
-    region_filter.accept(get_events_from(load_data_from(aedat4_file)))
-    filtered_events = region_filter.generateEvents()
-    return filtered_events
+    region_filter = _region_filter(center, crop_width, crop_height)
+
+    for batch in iter_event_batches(load_data_from(aedat4_file)):
+        region_filter.accept(batch)
+
+    return region_filter.generateEvents()
 
 
 def events_info(events: dv.EventStore) -> dict:
@@ -99,10 +197,18 @@ def events_info(events: dv.EventStore) -> dict:
 
     :return: A dictionary with keys: duration, first timestamp, last time stamp and events count of the given events.
     """
+    try:
+        first_timestamp = events.getLowestTime()
+        last_timestamp = events.getHighestTime()
+    except AttributeError:
+        timestamps = events.timestamps()
+        first_timestamp = timestamps[0]
+        last_timestamp = timestamps[-1]
+
     return {
         'duration': events.duration(),
-        'first timestamp': events.timestamps()[0],
-        'last timestamp': events.timestamps()[-1],
+        'first timestamp': first_timestamp,
+        'last timestamp': last_timestamp,
         'events count': events.size()
     }
 
@@ -111,7 +217,8 @@ def crop_preview_area(
         aedat4_file: str,
         center: tuple[int, int] = (173, 130),
         crop_width: int = 100,
-        crop_height: int = 100
+        crop_height: int = 100,
+        wait_ms: int = 0
 ) -> None:
     """
     Presents a screenshot of the original event stream and the cropped area side by side.
@@ -120,22 +227,24 @@ def crop_preview_area(
     :param center: a tuple with the x and y coordinates of the center of the cropped area.
     :param crop_width: horizontal length of the cropped area.
     :param crop_height: vertical length of the cropped area.
+    :param wait_ms: how long the preview stays open in milliseconds; 0 waits for a key press. Pass a positive value to auto-advance when previewing many files unattended.
 
     :return: None
     """
     data = load_data_from(aedat4_file)
     source_resolution = event_stream_resolution(data)
     source_events = get_events_from(data)
-    filtered_events = crop_centered_area(aedat4_file, center, crop_width, crop_height)
+    filtered_events = _crop_events(source_events, center, crop_width, crop_height)
 
     visualizer = dv.visualization.EventVisualizer(source_resolution)
     visualizer_input = visualizer.generateImage(source_events)
     visualizer_output = visualizer.generateImage(filtered_events)
 
-    preview = cv.hconcat([visualizer_input, visualizer_output])
+    preview = np.empty((source_resolution[1], 2 * source_resolution[0], 3), dtype=np.uint8)
+    np.concatenate((visualizer_input, visualizer_output), axis=1, out=preview)
     cv.namedWindow("preview", cv.WINDOW_NORMAL)
     cv.imshow("preview", preview)
-    cv.waitKey(0)
+    cv.waitKey(wait_ms)
     cv.destroyAllWindows()
 
 
@@ -160,38 +269,64 @@ def events_to_aedat4_file(
 
 def handle_path(path: str) -> None:
     """
-    Reads a path, if the directory does not exist, creates it.
+    Creates the given directory and its parents if they do not exist.
 
-    :param path: a directory path
+    :param path: a directory path; an empty path is ignored
 
     :return: None
     """
-    if not os.path.exists(path):
-        logger.warning(f"\nThe directory '{path}' does not exist. Creating...")
-        try:
-            os.makedirs(path)
-            logger.info(f"Successfully created the directory '{path}'.")
-        except Exception as e:
-            logger.critical(f"Failed to create the directory '{path}'. Error: {e}")
+    if not path:
+        return
+
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as e:
+        logger.critical(f"Failed to create the directory '{path}'. Error: {e}")
 
 
 def save_dict_to_csv(data: dict, csv_file_path: str) -> None:
     """
     Saves the given data dictionary to a CSV file with keys in the first column and values in the second column.
 
-    :param data: a directory
+    Missing values (None) are written as NaN.
+
+    :param data: a dictionary with numeric keys and values
     :param csv_file_path: path to the CSV file including the file name ended with '.csv'
 
     :return: None
     """
     path, _ = os.path.split(csv_file_path)
 
-    handle_path(path)
+    if path:
+        handle_path(path)
 
-    with open(csv_file_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        for key, value in data.items():
-            writer.writerow([key, value])
+    keys = np.fromiter(data.keys(), dtype=np.int64, count=len(data))
+    values = np.fromiter(
+        (np.nan if value is None else value for value in data.values()),
+        dtype=np.float64,
+        count=len(data)
+    )
+    np.savetxt(csv_file_path, np.column_stack((keys, values)), fmt=['%d', '%.6f'], delimiter=',')
+
+    logger.info(f"Successfully saved the data to '{csv_file_path}'.")
+
+
+def save_array_to_csv(values: np.ndarray, csv_file_path: str) -> None:
+    """
+    Saves the given values to a CSV file with the index in the first column and the value in the second column.
+
+    :param values: a one-dimensional numpy array
+    :param csv_file_path: path to the CSV file including the file name ended with '.csv'
+
+    :return: None
+    """
+    path, _ = os.path.split(csv_file_path)
+
+    if path:
+        handle_path(path)
+
+    indices = np.arange(values.shape[0])
+    np.savetxt(csv_file_path, np.column_stack((indices, values)), fmt=['%d', '%.6f'], delimiter=',')
 
     logger.info(f"Successfully saved the data to '{csv_file_path}'.")
 
@@ -202,32 +337,52 @@ def event_store_to_array(event_store: dv.EventStore) -> np.ndarray:
 
     :param event_store: An event store
 
-    :return: a numpy array with shape [2, 2] the x and y coordinates of the events.
+    :return: a numpy array with shape [N, 2] containing the x and y coordinates of the events.
     """
-    return np.array(list(map(lambda event: [event.x(), event.y()], event_store)))
+    try:
+        return event_store.coordinates().astype(np.int16, copy=False)
+    except AttributeError:
+        pass
 
+    try:
+        packet = event_store.numpy()
+    except AttributeError:
+        coordinates = np.empty((len(event_store), 2), dtype=np.int16)
 
-def _activate_pixels(empty_image: np.ndarray, events: np.ndarray) -> np.ndarray:
-    """
-    Assigns 255 to the entries of the empty_image corresponding to the given events array.
+        for i, event in enumerate(event_store):
+            coordinates[i] = (event.x(), event.y())
+
+        return coordinates
 
-    :param empty_image: a zeros numpy array with shape (2, 2)
-    :param events: a numpy array containing the events
+    return np.column_stack((packet['x'], packet['y'])).astype(np.int16, copy=False)
 
-    :return: a numpy array containing 255 in the inputs corresponding to the activated pixels and zero on the non activated pixels.
+
+def split_event_coordinates(events: np.ndarray | tuple) -> tuple[np.ndarray, np.ndarray]:
     """
-    image = empty_image
+    Normalizes the given events to structure-of-arrays form.
+
+    :param events: either an (xs, ys) tuple of coordinate arrays or a numpy array with shape [N, 2]
 
-    for x, y in events:
-        image[y, x] = 255
+    :return: the xs and ys coordinate arrays.
+    """
+    if isinstance(events, tuple):
+        return events
 
-    return image
+    return events[:, 0], events[:, 1]
 
 
-def _build_image(resolution: tuple, events: np.ndarray) -> np.ndarray:
-    empty_image = np.zeros((resolution[1], resolution[0]), dtype=np.uint8)
+def _line_endpoints(rho: float, theta: float) -> tuple[int, int, int, int]:
+    a = np.cos(theta)
+    b = np.sin(theta)
+    x0 = a * rho
+    y0 = b * rho
 
-    return _activate_pixels(empty_image, events)
+    return (
+        int(x0 + 1000 * (-b)),
+        int(y0 + 1000 * a),
+        int(x0 - 1000 * (-b)),
+        int(y0 - 1000 * a),
+    )
 
 
 def detect_line_angle(
@@ -238,44 +393,181 @@ def detect_line_angle(
         threshold: int = 10,
 ) -> tuple[float, tuple] | tuple[None, None]:
     """
-    Uses the Hough Lines algorithm to detect lines in the events
-    :param resolution: a tuple specifying the width and height in pixels of the given events.
+    Uses the Hough transform to detect the dominant line in the events.
+
+    Voting happens directly from the event coordinates into a (rho, theta) accumulator — through the Numba kernels when available, through a vectorized NumPy pass otherwise — so no intermediate image is ever rasterized or scanned.
 
-    :param events: a numpy array containing the events
+    :param resolution: a tuple specifying the width and height in pixels of the given events.
+    :param events: the events as an (xs, ys) tuple or a numpy array with shape [N, 2]
     :param rho: The resolution of the parameter r in pixels. 1 by default.
     :param theta: The resolution of the parameter theta in degrees. 1 degree by default.
     :param threshold: The minimum number of intersection to detect a line.
 
-    :return: a tuple containing the angle in degrees of the line and the parameter rho and theta, or a tuple containing None, None if no line is detected.
+    :return: a tuple containing the angle in degrees of the line and the endpoints (x1, y1, x2, y2) of the detected line, or a tuple containing None, None if no line is detected.
     """
-    image = _build_image(resolution, events)
+    return detect_line_angle_sparse(resolution, events, rho, theta, threshold)
+
+
+_degrees_per_radian = 180.0 / np.pi
+
+_theta_step = np.pi / 180
+_thetas = np.arange(0, np.pi, _theta_step, dtype=np.float32)
+_cos_thetas = np.cos(_thetas)
+_sin_thetas = np.sin(_thetas)
+
 
-    lines = cv2.HoughLines(image, rho, theta, threshold=threshold)
+def _hough_tables(theta: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    global _theta_step, _thetas, _cos_thetas, _sin_thetas
 
-    if lines is not None:
-        rho, theta = lines[0][0]
-        angle_in_degrees = theta * (180 / np.pi)
-        return angle_in_degrees, (rho, theta)
+    if theta != _theta_step:
+        _theta_step = theta
+        _thetas = np.arange(0, np.pi, theta, dtype=np.float32)
+        _cos_thetas = np.cos(_thetas)
+        _sin_thetas = np.sin(_thetas)
+
+    return _thetas, _cos_thetas, _sin_thetas
+
+
+def set_theta_resolution(theta: float) -> None:
+    """
+    Rebuilds the Hough cos/sin lookup tables for the given theta resolution.
+
+    The tables are rebuilt lazily whenever a detection call passes a different theta, so this is only needed to pay the rebuild cost up front.
+
+    :param theta: the resolution of the parameter theta in radians
+
+    :return: None
+    """
+    _hough_tables(theta)
+
+
+# Below this event count the per-call threading overhead outweighs the parallel voting gain.
+_parallel_vote_threshold = 10_000
+
+# Reused vote buffers, keyed by kind. Not thread-safe; switch to threading.local
+# storage if detection ever runs on concurrent threads of one process.
+_accumulator_buffers = {}
+
+
+def _zeroed_buffer(kind: str, shape: tuple, dtype: np.dtype) -> np.ndarray:
+    buffer = _accumulator_buffers.get(kind)
+
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = np.zeros(shape, dtype=dtype)
+        _accumulator_buffers[kind] = buffer
+    else:
+        buffer.fill(0)
+
+    return buffer
+
+
+def _sparse_hough_accumulator(
+        resolution: tuple,
+        xs: np.ndarray,
+        ys: np.ndarray,
+        rho: int = 1,
+        theta: float = np.pi / 180,
+) -> tuple[np.ndarray, np.ndarray]:
+    thetas, cos_thetas, sin_thetas = _hough_tables(theta)
+
+    max_rho = int(np.ceil(np.hypot(resolution[0], resolution[1])))
+
+    # A cell can receive at most one vote per event, so uint16 suffices for any
+    # realistic slice size and keeps the accumulator in L1/L2.
+    vote_dtype = np.uint16 if xs.shape[0] <= np.iinfo(np.uint16).max else np.int32
+
+    if utils_numba is not None and xs.shape[0] >= _parallel_vote_threshold:
+        thread_accumulators = _zeroed_buffer(
+            'parallel',
+            (utils_numba.get_num_threads(), 2 * max_rho + 1, thetas.shape[0]),
+            vote_dtype
+        )
+        utils_numba.hough_vote_parallel(
+            xs, ys, cos_thetas, sin_thetas, rho, max_rho, thread_accumulators
+        )
+        return thread_accumulators.sum(axis=0, dtype=np.int32), thetas
+
+    accumulator = _zeroed_buffer('serial', (2 * max_rho + 1, thetas.shape[0]), vote_dtype)
+
+    if utils_numba is not None:
+        utils_numba.hough_vote(xs, ys, cos_thetas, sin_thetas, rho, max_rho, accumulator)
+    else:
+        rhos = xs[:, None] * cos_thetas + ys[:, None] * sin_thetas
+        rho_bins = np.round(rhos / rho).astype(np.int32) + max_rho
+        np.add.at(accumulator, (rho_bins, np.arange(thetas.shape[0])[None, :]), 1)
+
+    return accumulator, thetas
+
+
+def detect_line_angle_sparse(
+        resolution: tuple,
+        events: np.ndarray,
+        rho: int = 1,
+        theta: float = np.pi / 180,
+        threshold: int = 10,
+) -> tuple[float, tuple] | tuple[None, None]:
+    """
+    Image-free variant of detect_line_angle that votes directly from the event coordinates.
+
+    Sparse slices leave most of the intermediate image at zero, so this variant skips building it and accumulates the Hough votes with a single vectorized pass over the events.
+
+    :param resolution: a tuple specifying the width and height in pixels of the given events.
+    :param events: the events as an (xs, ys) tuple or a numpy array with shape [N, 2]
+    :param rho: The resolution of the parameter r in pixels. 1 by default.
+    :param theta: The resolution of the parameter theta in degrees. 1 degree by default.
+    :param threshold: The minimum number of votes to detect a line.
+
+    :return: a tuple containing the angle in degrees of the line and the endpoints (x1, y1, x2, y2) of the detected line, or a tuple containing None, None if no line is detected.
+    """
+    xs, ys = split_event_coordinates(events)
+
+    if xs.shape[0] < threshold:
+        return None, None
+
+    accumulator, thetas = _sparse_hough_accumulator(resolution, xs, ys, rho, theta)
+
+    peak = np.argmax(accumulator)
+    if accumulator.flat[peak] >= threshold:
+        rho_bin, theta_bin = np.unravel_index(peak, accumulator.shape)
+        detected_rho = float((rho_bin - accumulator.shape[0] // 2) * rho)
+        detected_theta = float(thetas[theta_bin])
+        angle_in_degrees = detected_theta * _degrees_per_radian
+        return angle_in_degrees, _line_endpoints(detected_rho, detected_theta)
 
     return None, None
 
 
-def slice_every_events(source_events: dv.EventStore, events_per_slice: int = 800) -> list:
+def iter_event_slices(source_events: dv.EventStore, events_per_slice: int = 800):
     """
-    Create slices containing a specific number of events each slice.
+    Yields slices containing a specific number of events each slice.
+
+    Each slice is an (xs, ys) tuple of contiguous coordinate arrays, so downstream indexing and kernels get sequential loads.
+    The slices are yielded one at a time, so callers that process them in turn never hold a materialized list of every slice.
+    Incomplete trailing slices are dropped, matching the behaviour of dv.EventStreamSlicer.
 
     :param source_events: an event store
     :param events_per_slice: the number of events by slice
 
-    :return: a list of slices
+    :return: a generator of (xs, ys) slices
+    """
+    coordinates = event_store_to_array(source_events)
+    xs = np.ascontiguousarray(coordinates[:, 0])
+    ys = np.ascontiguousarray(coordinates[:, 1])
+    complete = xs.shape[0] // events_per_slice * events_per_slice
+
+    for start in range(0, complete, events_per_slice):
+        yield xs[start:start + events_per_slice], ys[start:start + events_per_slice]
+
+
+def slice_every_events(source_events: dv.EventStore, events_per_slice: int = 800) -> list:
     """
-    slicer = dv.EventStreamSlicer()
-    slices = []
+    Create slices containing a specific number of events each slice.
 
-    def slicer_callback(events: dv.EventStore) -> None:
-        slices.append(event_store_to_array(events))
+    Materializes every slice of iter_event_slices; prefer the generator when the slices are consumed one at a time.
 
-    slicer.doEveryNumberOfEvents(events_per_slice, slicer_callback)
-    slicer.accept(source_events)
+    :param source_events: an event store
+    :param events_per_slice: the number of events by slice
 
-    return slices
\ No newline at end of file
+    :return: a list of (xs, ys) slices
+    """
+    return list(iter_event_slices(source_events, events_per_slice))
\ No newline at end of file
@@ -0,0 +1,69 @@
+import numpy as np
+from numba import njit, prange, get_num_threads, get_thread_id
+
+
+@njit(cache=True, fastmath=True)
+def hough_vote(
+        xs: np.ndarray,
+        ys: np.ndarray,
+        cos_thetas: np.ndarray,
+        sin_thetas: np.ndarray,
+        rho_resolution: float,
+        rho_offset: int,
+        accumulator: np.ndarray,
+) -> None:
+    """
+    Accumulates Hough votes for the given event coordinates in one fused pass.
+
+    Votes directly from the coordinates, so no intermediate image is rasterized or scanned.
+
+    :param xs: the x coordinates of the events
+    :param ys: the y coordinates of the events
+    :param cos_thetas: cosine of every theta bin
+    :param sin_thetas: sine of every theta bin
+    :param rho_resolution: the resolution of the parameter rho in pixels
+    :param rho_offset: the accumulator row of rho = 0
+    :param accumulator: a zeroed (rho, theta) vote array, filled in place
+
+    :return: None
+    """
+    for i in range(xs.shape[0]):
+        x = xs[i]
+        y = ys[i]
+        for k in range(cos_thetas.shape[0]):
+            r = int(np.round((x * cos_thetas[k] + y * sin_thetas[k]) / rho_resolution)) + rho_offset
+            accumulator[r, k] += 1
+
+
+@njit(parallel=True, cache=True, fastmath=True)
+def hough_vote_parallel(
+        xs: np.ndarray,
+        ys: np.ndarray,
+        cos_thetas: np.ndarray,
+        sin_thetas: np.ndarray,
+        rho_resolution: float,
+        rho_offset: int,
+        thread_accumulators: np.ndarray,
+) -> None:
+    """
+    Parallel variant of hough_vote that splits the events across all cores.
+
+    Each thread votes into its own accumulator tile to avoid atomic contention; the caller reduces the tiles with a sum over the first axis.
+
+    :param xs: the x coordinates of the events
+    :param ys: the y coordinates of the events
+    :param cos_thetas: cosine of every theta bin
+    :param sin_thetas: sine of every theta bin
+    :param rho_resolution: the resolution of the parameter rho in pixels
+    :param rho_offset: the accumulator row of rho = 0
+    :param thread_accumulators: a zeroed (threads, rho, theta) vote array, filled in place
+
+    :return: None
+    """
+    for i in prange(xs.shape[0]):
+        tid = get_thread_id()
+        x = xs[i]
+        y = ys[i]
+        for k in range(cos_thetas.shape[0]):
+            r = int(np.round((x * cos_thetas[k] + y * sin_thetas[k]) / rho_resolution)) + rho_offset
+            thread_accumulators[tid, r, k] += 1